@@ -0,0 +1,59 @@
+import hashlib
+from typing import Dict, List, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+DEDUP_MODES = ("none", "exact", "near")
+
+# 64-bit SimHash split into 4 bands of 16 bits: two hashes within
+# Hamming distance 3 must agree on at least one band (pigeonhole)
+_BANDS = 4
+_BAND_BITS = 16
+_BAND_MASK = (1 << _BAND_BITS) - 1
+
+
+def _simhash(text: str, shingle: int = 3) -> int:
+    words = text.lower().split()
+    grams = [" ".join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1))]
+    digests = b"".join(hashlib.blake2b(gram.encode(), digest_size=8).digest() for gram in grams)
+    # one row of 64 bits per shingle; a bit is set in the SimHash when it is
+    # set in more than half of the shingles
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    majority = 2 * bits.sum(axis=0, dtype=np.int64) > len(grams)
+    return int.from_bytes(np.packbits(majority).tobytes(), "big")
+
+
+def dedup_documents(docs: List[Document], mode: str = "near", max_distance: int = 3) -> List[Document]:
+    """
+    Drop duplicate chunks before they are embedded, keeping the first occurrence.
+    'exact' compares content hashes, 'near' additionally drops chunks whose
+    SimHash is within max_distance bits (<= 3) of an earlier chunk.
+    """
+    if mode == "none":
+        return docs
+
+    seen: Set[bytes] = set()
+    buckets: Dict[Tuple[int, int], List[int]] = {}
+    kept: List[Document] = []
+    for doc in docs:
+        digest = hashlib.blake2b(doc.page_content.encode(), digest_size=16).digest()
+        if digest in seen:
+            continue
+        seen.add(digest)
+
+        if mode == "near":
+            h = _simhash(doc.page_content)
+            keys = [(band, (h >> (band * _BAND_BITS)) & _BAND_MASK) for band in range(_BANDS)]
+            if any(bin(h ^ other).count("1") <= max_distance
+                   for key in keys for other in buckets.get(key, ())):
+                continue
+            for key in keys:
+                buckets.setdefault(key, []).append(h)
+
+        kept.append(doc)
+
+    dropped = len(docs) - len(kept)
+    if dropped:
+        print(f"[*] Dropped {dropped} duplicate chunks ({mode}).")
+    return kept
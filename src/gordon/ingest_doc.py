@@ -1,21 +1,50 @@
 import os
 import sys
 import argparse
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Optional
 
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
+from langchain_community import document_loaders
 
-from .loadmodel import embeddings
+from .dedup import DEDUP_MODES, dedup_documents
+from .splitter import SPLITTERS, split_documents
+from .vectorstore import add_to_store
 
-def load_papers(directory: str) -> List:
-    docs = []
-    for filename in os.listdir(directory):
-        if filename.endswith(".pdf"):
-            loader = PyPDFLoader(os.path.join(directory, filename))
-            docs.extend(loader.load())
-    return docs
+# pypdf is pure Python; pdfium and PyMuPDF are C-backed and much faster
+PDF_LOADERS = {
+    "pypdf": "PyPDFLoader",
+    "pymupdf": "PyMuPDFLoader",
+    "pdfium": "PyPDFium2Loader",
+}
+
+
+def _load_one(path: str, loader: str = "pdfium") -> List:
+    loader_cls = getattr(document_loaders, PDF_LOADERS[loader])
+    return loader_cls(path).load()
+
+
+def load_papers(directory: str, workers: Optional[int] = None, loader: str = "pdfium") -> List:
+    """
+    Load every PDF in directory. Text extraction is CPU-bound,
+    so files are spread across a process pool.
+    """
+    pdf_paths = [
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.endswith(".pdf")
+    ]
+    if not pdf_paths:
+        return []
+
+    load_one = partial(_load_one, loader=loader)
+    workers = min(workers or os.cpu_count() or 1, len(pdf_paths))
+    if workers == 1:
+        results = list(map(load_one, pdf_paths))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as ex:
+            results = list(ex.map(load_one, pdf_paths))
+    return [doc for pages in results for doc in pages]
 
 
 def main():
@@ -37,34 +66,49 @@ def main():
         help="Directory where FAISS index is saved/loaded"
     )
     parser.add_argument(
-        "--device", default="cpu",
-        help="Device for embeddings model (eg. 'cpu' or 'cuda')"
+        "--device", default=None,
+        help="Deprecated and ignored: ingest always runs on CPU, see query --device"
+    )
+    parser.add_argument(
+        "--index-spec", default="Flat",
+        help="faiss.index_factory string for a new index, eg. 'HNSW32' or 'IVF256,Flat' (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None,
+        help="Number of processes used to load PDFs (default: CPU count)"
+    )
+    parser.add_argument(
+        "--loader", choices=sorted(PDF_LOADERS), default="pdfium",
+        help="PDF text extractor (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--splitter", choices=SPLITTERS, default="recursive",
+        help="Text splitter backend (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--dedup", choices=DEDUP_MODES, default="near",
+        help="Drop exact or near-duplicate chunks before embedding (default: %(default)s)"
     )
     args = parser.parse_args()
 
+    if args.device is not None:
+        print("[!] --device is deprecated and ignored; ingest always runs on CPU (use query --device).")
+
     print(f"[*] Loading papers from '{args.doc_dir}' ...")
-    raw_docs = load_papers(args.doc_dir)
+    raw_docs = load_papers(args.doc_dir, workers=args.workers, loader=args.loader)
     if not raw_docs:
         print(f"[!] No PDF documents found in '{args.doc_dir}'. Exiting.")
         sys.exit(1)
 
     print("[*] Splitting documents into chunks...")
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap
-    )
-    docs = splitter.split_documents(raw_docs)
+    docs = split_documents(raw_docs, args.chunk_size, args.chunk_overlap, splitter=args.splitter)
+    docs = dedup_documents(docs, mode=args.dedup)
 
-    index_path = args.output
-    if os.path.exists(index_path):
-        print(f"[*] Loading existing FAISS index from '{index_path}' and adding documents...")
-        vectordb = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-        vectordb.add_documents(docs)
-    else:
-        print("[*] Creating new FAISS index from documents...")
-        vectordb = FAISS.from_documents(docs, embeddings)
-
-    print(f"[*] Saving vector store to '{index_path}' ...")
-    vectordb.save_local(index_path)
+    try:
+        add_to_store(docs, args.output, index_spec=args.index_spec)
+    except ValueError as e:
+        print(f"[!] {e}")
+        sys.exit(1)
     print("[*] Done.")
 
 
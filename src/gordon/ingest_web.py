@@ -1,16 +1,21 @@
 import argparse
 import asyncio
-import json
+import codecs
+import hashlib
 import os
+import re
+import sqlite3
 import sys
-from typing import List, Dict, Any, Set, Optional, Tuple
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import List, Dict, Any, Set, Optional, Tuple, Union
 import aiohttp
+import orjson
 import urllib
-from bs4 import BeautifulSoup
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
+from selectolax.lexbor import LexborHTMLParser
 from langchain.docstore.document import Document
-from .loadmodel import embeddings
+from .dedup import DEDUP_MODES, dedup_documents
+from .splitter import SPLITTERS, split_documents
+from .vectorstore import add_to_store
 from urllib.parse import urljoin, urldefrag
 
 def load_sources(json_path: str) -> List[Dict[str, Any]]:
@@ -18,8 +23,8 @@ def load_sources(json_path: str) -> List[Dict[str, Any]]:
     Load sources JSON, normalize it so each entry has a single 'url' string.
     Supports 'url' field as string or list of strings.
     """
-    with open(json_path, "r", encoding="utf-8") as f:
-        sources = json.load(f)
+    with open(json_path, "rb") as f:
+        sources = orjson.loads(f.read())
     if not isinstance(sources, list):
         raise ValueError("JSON root must be a list of objects")
     normalized_sources = []
@@ -40,50 +45,188 @@ def load_sources(json_path: str) -> List[Dict[str, Any]]:
     return normalized_sources
 
 
-async def fetch_page(session: aiohttp.ClientSession, url: str, timeout: int = 15) -> str:
+class PageCache:
+    """
+    On-disk cache of fetched pages (validators, charset and body) keyed by URL,
+    used for conditional GETs, plus a record of which pages were ingested with
+    which tags/selectors. Fetched pages are only staged; scrape_one accepts a
+    page once it has produced documents, and both become durable on commit(),
+    which main() calls once the index has been saved. Whether a page is
+    unchanged is decided from committed records only, so a page reported as
+    unchanged is always one that is already in that index.
+    """
+
+    def __init__(self, path: str):
+        self._pending: Dict[str, Tuple[Optional[str], Optional[str], Optional[str], bytes, bytes]] = {}
+        self._accepted: Dict[Tuple[str, str], bytes] = {}
+        # pages skipped by scrape_one as already ingested
+        self.unchanged = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, charset TEXT, body_hash BLOB, body BLOB)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingested ("
+            "url TEXT, extract_key TEXT, body_hash BLOB, PRIMARY KEY (url, extract_key))"
+        )
+
+    @staticmethod
+    def extract_key(src: Dict[str, Any]) -> str:
+        return orjson.dumps([src.get("tags") or [], src.get("selectors") or []]).decode()
+
+    def get(self, url: str) -> Optional[Tuple[Optional[str], Optional[str], Optional[str], bytes, bytes]]:
+        if url in self._pending:
+            return self._pending[url]
+        return self._conn.execute(
+            "SELECT etag, last_modified, charset, body_hash, body FROM pages WHERE url = ?", (url,)
+        ).fetchone()
+
+    def stage(self, url: str, etag: Optional[str], last_modified: Optional[str], charset: Optional[str],
+              body_hash: bytes, body: bytes) -> None:
+        self._pending[url] = (etag, last_modified, charset, body_hash, body)
+
+    def is_ingested(self, url: str, key: str, body_hash: bytes) -> bool:
+        row = self._conn.execute(
+            "SELECT body_hash FROM ingested WHERE url = ? AND extract_key = ?", (url, key)
+        ).fetchone()
+        return row is not None and row[0] == body_hash
+
+    def accept(self, url: str, key: str, body_hash: bytes) -> None:
+        self._accepted[(url, key)] = body_hash
+
+    def commit(self) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?)",
+                [(url, *entry) for url, entry in self._pending.items()],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO ingested VALUES (?, ?, ?)",
+                [(url, key, body_hash) for (url, key), body_hash in self._accepted.items()],
+            )
+        self._pending.clear()
+        self._accepted.clear()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+async def fetch_page(session: aiohttp.ClientSession, url: str, timeout: int = 15,
+                     cache: Optional[PageCache] = None) -> Tuple[bytes, Optional[str], bytes]:
+    """
+    Fetch url and return (raw body, charset from Content-Type, body hash).
+    The body is not decoded here, so the parse workers receive bytes
+    (cheaper to pickle than str) and decode them with decode_html.
+    With a cache, a conditional GET is sent and a 304 answer returns the
+    cached body.
+    """
     headers = {
         "User-Agent": "ingest-web/0.1.0 (+https://github.com/aixnr/gordon)"
     }
+    cached = cache.get(url) if cache else None
+    if cached:
+        etag, last_modified, _, _, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
     client_timeout = aiohttp.ClientTimeout(total=timeout)
     async with session.get(url, headers=headers, timeout=client_timeout) as resp:
         resp.raise_for_status()
-        return await resp.text()
+        if cached and resp.status == 304:
+            return cached[4], cached[2], cached[3]
+        body = await resp.read()
+        charset = resp.charset
+
+    body_hash = hashlib.blake2b(body, digest_size=16).digest()
+    if cache is not None:
+        cache.stage(url, resp.headers.get("ETag"), resp.headers.get("Last-Modified"), charset, body_hash, body)
+    return body, charset, body_hash
+
+
+_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w.:-]+)""", re.IGNORECASE)
+
+
+def _lookup_codec(name: Optional[str]) -> Optional[str]:
+    if not name:
+        return None
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
+        return None
+
+
+def decode_html(html: Union[str, bytes], charset: Optional[str] = None) -> str:
+    """
+    Decode a raw page, as resp.text() would: the charset from the HTTP
+    Content-Type header first, then the one declared in a <meta> tag, then
+    UTF-8 if the body is valid UTF-8, then charset_normalizer's guess.
+    lexbor itself assumes UTF-8 input.
+    """
+    if isinstance(html, str):
+        return html
+    encoding = _lookup_codec(charset)
+    if encoding is None:
+        match = _CHARSET_RE.search(html[:4096])
+        if match:
+            encoding = _lookup_codec(match.group(1).decode("ascii", errors="ignore"))
+    if encoding is None:
+        try:
+            return html.decode("utf-8")
+        except UnicodeDecodeError:
+            encoding = "utf-8"
+            try:
+                from charset_normalizer import from_bytes
 
+                best = from_bytes(html).best()
+                if best is not None:
+                    encoding = best.encoding
+            except ImportError:
+                pass
+    return html.decode(encoding, errors="replace")
 
-def parse_extract(html: str, src: Dict[str, Any]) -> List[Dict[str, str]]:
+
+def parse_extract(html: Union[str, bytes], src: Dict[str, Any],
+                  charset: Optional[str] = None) -> List[Dict[str, str]]:
     """
-    Parse HTML with BeautifulSoup and extract blocks based on tags/selectors.
+    Parse HTML with selectolax (lexbor) and extract blocks based on tags/selectors.
+    charset is the one from the HTTP response, if any (see decode_html).
     Returns list of {"text": ..., "method": "tag|selector|fallback", "pattern": ...}.
     """
-    soup = BeautifulSoup(html, "html.parser")
+    tree = LexborHTMLParser(decode_html(html, charset))
     items: List[Dict[str, str]] = []
     tags = src.get("tags") or []
     selectors = src.get("selectors") or []
     # By tag name
     for tag in tags:
-        for el in soup.find_all(tag):
-            text = el.get_text(separator=" ", strip=True)
+        for el in tree.css(tag):
+            text = el.text(separator=" ", strip=True)
             if text:
                 items.append({"text": text, "method": "tag", "pattern": tag})
     # By CSS selector
     for sel in selectors:
-        for el in soup.select(sel):
-            text = el.get_text(separator=" ", strip=True)
+        for el in tree.css(sel):
+            text = el.text(separator=" ", strip=True)
             if text:
                 items.append({"text": text, "method": "selector", "pattern": sel})
     # Fallback to body if nothing found
     if not items:
-        body = soup.body.get_text(separator=" ", strip=True) if soup.body else soup.get_text(separator=" ", strip=True)
+        root = tree.body or tree.root
+        body = root.text(separator=" ", strip=True) if root else ""
         if body:
             items.append({"text": body, "method": "fallback", "pattern": "body"})
     return items
 
 
 async def scrape_one(session: aiohttp.ClientSession, src: Dict[str, Any], semaphore: asyncio.Semaphore,
-                     pause: float, loop: asyncio.AbstractEventLoop) -> List[Document]:
+                     pause: float, loop: asyncio.AbstractEventLoop,
+                     executor: Optional[Executor] = None, cache: Optional[PageCache] = None) -> List[Document]:
     """
     Fetch a single URL and extract documents (as langchain Documents).
-    Runs BeautifulSoup parsing in a threadpool to avoid blocking the event loop.
+    Runs HTML parsing in executor (the loop's default threadpool if None)
+    to avoid blocking the event loop. Pages already ingested with the same
+    body and tags/selectors yield no documents.
     """
     url = src.get("url")
     if not url:
@@ -92,14 +235,20 @@ async def scrape_one(session: aiohttp.ClientSession, src: Dict[str, Any], semaph
 
     async with semaphore:
         try:
-            html = await fetch_page(session, url)
+            html, charset, body_hash = await fetch_page(session, url, cache=cache)
         except Exception as e:
             print(f"[!] Failed to fetch {url}: {e}")
             return []
 
-    # Parse and extract in threadpool
+    key = PageCache.extract_key(src)
+    if cache and cache.is_ingested(url, key, body_hash):
+        cache.unchanged += 1
+        print(f"[*] Unchanged since last ingest, skipping {url}")
+        return []
+
+    # Parse and extract off the event loop
     try:
-        extracted = await loop.run_in_executor(None, parse_extract, html, src)
+        extracted = await loop.run_in_executor(executor, parse_extract, html, src, charset)
     except Exception as e:
         print(f"[!] Failed to parse/extract {url}: {e}")
         return []
@@ -113,6 +262,8 @@ async def scrape_one(session: aiohttp.ClientSession, src: Dict[str, Any], semaph
             "block_index": i,
         }
         docs.append(Document(page_content=item["text"], metadata=metadata))
+    if cache and docs:
+        cache.accept(url, key, body_hash)
 
     # optional polite pause (between releasing semaphore and returning)
     if pause and pause > 0:
@@ -121,7 +272,7 @@ async def scrape_one(session: aiohttp.ClientSession, src: Dict[str, Any], semaph
     return docs
 
 
-def extract_links(base_url: str, html: str) -> Set[str]:
+def extract_links(base_url: str, html: Union[str, bytes], charset: Optional[str] = None) -> Set[str]:
     """
     Extract and normalize all href links found in html relative to base_url.
     Excludes links ending with common media file extensions and JS/CSS files.
@@ -133,10 +284,12 @@ def extract_links(base_url: str, html: str) -> Set[str]:
         '.css', '.js'
     )
 
-    soup = BeautifulSoup(html, "html.parser")
+    tree = LexborHTMLParser(decode_html(html, charset))
     links = set()
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
+    for a in tree.css("a[href]"):
+        href = a.attributes.get("href")
+        if not href:
+            continue
         abs_url = urljoin(base_url, href)
         abs_url, _ = urldefrag(abs_url)  # Remove fragment
 
@@ -151,7 +304,8 @@ def extract_links(base_url: str, html: str) -> Set[str]:
 async def crawl_and_scrape(session: aiohttp.ClientSession, initial_src: Dict[str, Any],
                            semaphore: asyncio.Semaphore, pause: float,
                            loop: asyncio.AbstractEventLoop, max_depth: Optional[int] = None,
-                           timeout: int = 15) -> List[Document]:
+                           timeout: int = 15, executor: Optional[Executor] = None,
+                           cache: Optional[PageCache] = None) -> List[Document]:
     """
     Crawl starting from initial_src['url'] up to max_depth links deep.
     Collect Documents from all pages found.
@@ -182,7 +336,7 @@ async def crawl_and_scrape(session: aiohttp.ClientSession, initial_src: Dict[str
         src = dict(current_src)
         src["url"] = current_url
 
-        page_docs = await scrape_one(session, src, semaphore, pause, loop)
+        page_docs = await scrape_one(session, src, semaphore, pause, loop, executor=executor, cache=cache)
         docs.extend(page_docs)
 
         if depth >= max_depth:
@@ -190,12 +344,12 @@ async def crawl_and_scrape(session: aiohttp.ClientSession, initial_src: Dict[str
 
         # Fetch the page to extract links for the next crawl depth
         try:
-            html = await fetch_page(session, current_url, timeout=timeout)
+            html, charset, _ = await fetch_page(session, current_url, timeout=timeout, cache=cache)
         except Exception as e:
             print(f"[!] Failed to fetch page for links {current_url}: {e}")
             continue
 
-        links = extract_links(current_url, html)
+        links = extract_links(current_url, html, charset)
 
         for link in links:
             if link not in visited:
@@ -205,10 +359,12 @@ async def crawl_and_scrape(session: aiohttp.ClientSession, initial_src: Dict[str
 
 
 async def scrape_sources_async(sources: List[Dict[str, Any]], concurrency: int = 5,
-                               pause: float = 0.0, timeout: int = 15) -> List[Document]:
+                               pause: float = 0.0, timeout: int = 15,
+                               cache: Optional[PageCache] = None) -> List[Document]:
     """
     Scrape multiple sources concurrently with link crawling according to GORDON_CRAWL_DEPTH env var.
     Each source will be crawled (if depth > 0) or scraped alone (depth=0).
+    HTML parsing is CPU-bound, so it runs in a process pool rather than threads.
     """
     connector = aiohttp.TCPConnector(limit_per_host=concurrency)
     timeout_obj = aiohttp.ClientTimeout(total=None)  # timeout handled in fetch_page
@@ -218,28 +374,56 @@ async def scrape_sources_async(sources: List[Dict[str, Any]], concurrency: int =
     loop = asyncio.get_event_loop()
 
     max_depth = int(os.getenv("GORDON_CRAWL_DEPTH", "0"))
-    async with aiohttp.ClientSession(connector=connector, timeout=timeout_obj, headers=headers) as session:
-        tasks = []
-        for src in sources:
-            # For each source, create a crawl_and_scrape task
-            tasks.append(asyncio.create_task(
-                crawl_and_scrape(session, src, semaphore, pause, loop, max_depth=max_depth, timeout=timeout)
-            ))
-        for task in asyncio.as_completed(tasks):
-            try:
-                res = await task
-            except Exception as e:
-                print("[!] Task error:", e)
-                res = []
-            docs.extend(res)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as parse_pool:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout_obj, headers=headers) as session:
+            tasks = []
+            for src in sources:
+                # For each source, create a crawl_and_scrape task
+                tasks.append(asyncio.create_task(
+                    crawl_and_scrape(session, src, semaphore, pause, loop, max_depth=max_depth,
+                                     timeout=timeout, executor=parse_pool, cache=cache)
+                ))
+            # gather keeps results in source order
+            results = await asyncio.gather(*tasks, return_exceptions=True)
+
+    for res in results:
+        if isinstance(res, BaseException):
+            print("[!] Task error:", res)
+            continue
+        docs.extend(res)
 
     return docs
 
 
-def save_manifest(manifest: List[Dict[str, Any]], output_dir: str) -> None:
+MANIFEST_FORMATS = ("json", "parquet")
+
+
+def save_manifest(manifest: List[Dict[str, Any]], output_dir: str, fmt: str = "json") -> str:
+    """
+    Write the manifest to output_dir and return its path. 'parquet' stores it
+    column-wise (dictionary-encoded, zstd), which is much smaller than JSON
+    for many chunks from the same few URLs; it needs pyarrow.
+    """
+    if fmt == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        path = os.path.join(output_dir, "manifest.parquet")
+        table = pa.table({
+            "id": pa.array([m["id"] for m in manifest], type=pa.int64()),
+            "source": pa.array([m["source"] for m in manifest], type=pa.string()).dictionary_encode(),
+            "extract_method": pa.array([m["extract_method"] for m in manifest], type=pa.string()).dictionary_encode(),
+            "extract_pattern": pa.array([m["extract_pattern"] for m in manifest], type=pa.string()).dictionary_encode(),
+            "block_index": pa.array([m["block_index"] for m in manifest], type=pa.int32()),
+            "snippet": pa.array([m["snippet"] for m in manifest], type=pa.large_string()),
+        })
+        pq.write_table(table, path, compression="zstd")
+        return path
+
     path = os.path.join(output_dir, "manifest.json")
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    with open(path, "wb") as f:
+        f.write(orjson.dumps(manifest, option=orjson.OPT_INDENT_2))
+    return path
 
 
 def main():
@@ -251,8 +435,24 @@ def main():
     parser.add_argument("--concurrency", type=int, default=5, help="Max concurrent requests")
     parser.add_argument("--timeout", type=int, default=15, help="Per-request timeout (seconds)")
     parser.add_argument("--output", default="faiss_index", help="Directory to save FAISS index and manifest")
+    parser.add_argument("--splitter", choices=SPLITTERS, default="recursive", help="Text splitter backend")
+    parser.add_argument("--dedup", choices=DEDUP_MODES, default="near",
+                        help="Drop exact or near-duplicate chunks (eg. repeated nav/footers) before embedding")
+    parser.add_argument("--manifest", choices=MANIFEST_FORMATS, default="json",
+                        help="Manifest file format (parquet needs pyarrow)")
+    parser.add_argument("--index-spec", default="Flat",
+                        help="faiss.index_factory string for a new index, eg. 'HNSW32' or 'IVF256,Flat'")
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=True,
+                        help="Send conditional requests and skip pages unchanged since the last ingest")
     args = parser.parse_args()
 
+    if args.manifest == "parquet":
+        try:
+            import pyarrow
+        except ImportError:
+            print('[!] --manifest parquet needs pyarrow: uv pip install ".[parquet]"')
+            sys.exit(1)
+
     try:
         sources = load_sources(args.json)
     except Exception as e:
@@ -262,9 +462,14 @@ def main():
     print(f"[*] Scraping {len(sources)} web sources with concurrency={args.concurrency} and "
           f"crawl depth={os.getenv('GORDON_CRAWL_DEPTH', '0')} ...")
 
+    cache = None
+    if args.cache:
+        os.makedirs(args.output, exist_ok=True)
+        cache = PageCache(os.path.join(args.output, "webcache.sqlite"))
+
     try:
         raw_docs = asyncio.run(scrape_sources_async(sources, concurrency=args.concurrency,
-                                                    pause=args.pause, timeout=args.timeout))
+                                                    pause=args.pause, timeout=args.timeout, cache=cache))
     except KeyboardInterrupt:
         print("[!] Interrupted.")
         sys.exit(1)
@@ -273,24 +478,29 @@ def main():
         sys.exit(1)
 
     if not raw_docs:
+        unchanged = cache.unchanged if cache else 0
+        if cache:
+            cache.close()
+        if unchanged:
+            # steady state, not an error
+            print(f"[*] {unchanged} pages unchanged since the last ingest, nothing to add "
+                  "(pass --no-cache to re-ingest them).")
+            sys.exit(0)
         print("[!] No documents extracted. Exiting.")
         sys.exit(1)
 
     print(f"[*] Extracted {len(raw_docs)} blocks. Splitting into chunks...")
-    splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap)
-    docs = splitter.split_documents(raw_docs)
-
-    index_path = args.output
-    if os.path.exists(index_path):
-        print(f"[*] Loading existing FAISS index from '{index_path}' and adding documents...")
-        vectordb = FAISS.load_local(index_path, embeddings, allow_dangerous_deserialization=True)
-        vectordb.add_documents(docs)
-    else:
-        print("[*] Creating new FAISS index from documents...")
-        vectordb = FAISS.from_documents(docs, embeddings)
+    docs = split_documents(raw_docs, args.chunk_size, args.chunk_overlap, splitter=args.splitter)
+    docs = dedup_documents(docs, mode=args.dedup)
 
-    print(f"[*] Saving updated vector store at '{index_path}' ...")
-    vectordb.save_local(index_path)
+    try:
+        add_to_store(docs, args.output, index_spec=args.index_spec)
+    except ValueError as e:
+        print(f"[!] {e}")
+        sys.exit(1)
+    if cache:
+        cache.commit()
+        cache.close()
 
     # Build manifest mapping doc IDs to source and metadata
     manifest: List[Dict[str, Any]] = []
@@ -306,8 +516,8 @@ def main():
         }
         manifest.append(entry)
 
-    save_manifest(manifest, args.output)
-    print(f"[*] Saved manifest with {len(manifest)} entries to '{os.path.join(args.output, 'manifest.json')}'")
+    manifest_path = save_manifest(manifest, args.output, fmt=args.manifest)
+    print(f"[*] Saved manifest with {len(manifest)} entries to '{manifest_path}'")
     print("[*] Done.")
 
 
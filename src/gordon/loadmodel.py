@@ -1,5 +1,9 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from langchain_core.embeddings import Embeddings
 from langchain_openai import ChatOpenAI
 from pydantic import SecretStr
@@ -12,6 +16,8 @@ model_chat = os.getenv("GORDON_MODEL_CHAT", "gpt-oss-20b")
 model_embedding = os.getenv("GORDON_MODEL_EMBEDDING", "text-embedding-mxbai-embed-large-v1")
 api_endpoint = os.getenv("GORDON_MODEL_ENDPOINT", "http://127.0.0.1:1234/v1")
 api_key = os.getenv("GORDON_API_KEY", "dummy-key")
+embed_batch = int(os.getenv("GORDON_EMBED_BATCH", "64"))
+embed_concurrency = int(os.getenv("GORDON_EMBED_CONCURRENCY", "8"))
 
 # announce to user
 print(f"[*] API endpoint is {api_endpoint}")
@@ -20,28 +26,61 @@ print(f"[*] Using {model_chat} for the conversation...")
 
 
 class LocalOpenAIEmbeddings(Embeddings):
-    def __init__(self, model, base_url=api_endpoint, api_key=api_key):
+    def __init__(self, model, base_url=api_endpoint, api_key=api_key,
+                 batch_size=embed_batch, concurrency=embed_concurrency):
         self.model = model
         self.base_url = base_url
         self.api_key = api_key
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self._url = f"{self.base_url}/embeddings"
+        self._headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+        # reuse keep-alive connections instead of a new socket per request
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=16,
+            pool_maxsize=max(32, self.concurrency),
+            max_retries=Retry(total=3, backoff_factor=0.2, allowed_methods=None),
+        )
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        # repeated questions in the REPL skip the HTTP round trip
+        self._embed_query_cached = lru_cache(maxsize=256)(self._embed_query)
+
+    def _embed_batch(self, batch):
+        resp = self._session.post(
+            self._url,
+            headers=self._headers,
+            json={"model": self.model, "input": batch}  # list of strings
+        )
+        resp.raise_for_status()
+        # the server may return items out of order, 'index' is authoritative
+        data = sorted(resp.json()["data"], key=lambda item: item["index"])
+        return [item["embedding"] for item in data]
 
     def embed_documents(self, texts):
+        texts = list(texts)
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.concurrency == 1:
+            return [emb for batch in batches for emb in self._embed_batch(batch)]
+
+        # keep the local server saturated with a few in-flight batches;
+        # map() preserves batch order so results line up with texts
         results = []
-        for text in texts:
-            resp = requests.post(
-                f"{self.base_url}/embeddings",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                },
-                json={"model": self.model, "input": text}  # single string
-            )
-            resp.raise_for_status()
-            results.append(resp.json()["data"][0]["embedding"])
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batches))) as ex:
+            for embs in ex.map(self._embed_batch, batches):
+                results.extend(embs)
         return results
 
+    def _embed_query(self, text):
+        return self._embed_batch([text])[0]
+
     def embed_query(self, text):
-        return self.embed_documents([text])[0]
+        normalized = " ".join(text.split())
+        return list(self._embed_query_cached(normalized))
 
 
 embeddings = LocalOpenAIEmbeddings(model=model_embedding)
@@ -1,13 +1,13 @@
 import argparse
-from langchain_community.vectorstores import FAISS
+from concurrent.futures import ThreadPoolExecutor
 from rich.console import Console
 from rich.markdown import Markdown
 from rich.pretty import pprint
 from prompt_toolkit import prompt as prpt
-import tiktoken
 
-from .loadmodel import embeddings
 from .graph import return_graph
+from .splitter import get_encoding
+from .vectorstore import DEFAULT_NPROBE, DEVICES, load_store
 
 
 def main():
@@ -25,18 +25,48 @@ def main():
         action="store_true",
         help="Whether to pprint the retrieved context documents.",
     )
+    parser.add_argument(
+        "--device",
+        choices=DEVICES,
+        default="cpu",
+        help="Keep the FAISS index on this device; gpu needs faiss-gpu (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--fp16",
+        action="store_true",
+        help="Store vectors as float16 on the GPU (with --device gpu).",
+    )
+    parser.add_argument(
+        "--mmap",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Memory-map the FAISS index instead of reading it into RAM (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--nprobe",
+        type=int,
+        default=None,
+        help=f"IVF lists searched per query, more is slower but finds more (default: {DEFAULT_NPROBE})",
+    )
+    parser.add_argument(
+        "--ef-search",
+        type=int,
+        default=None,
+        help="HNSW search depth, more is slower but finds more (default: faiss's 16)",
+    )
     args = parser.parse_args()
 
-    vectordb = FAISS.load_local(
-        args.index_path,
-        embeddings,
-        allow_dangerous_deserialization=True
-    )
+    vectordb = load_store(args.index_path, device=args.device, fp16=args.fp16, mmap=args.mmap,
+                          nprobe=args.nprobe, ef_search=args.ef_search)
+    # touch the index pages and the embedding model before the first question
+    vectordb.similarity_search("warmup", k=1)
 
     graph = return_graph(vectordb=vectordb)
 
     console = Console()
-    encoding = tiktoken.encoding_for_model("gpt-4o")
+    encoding = get_encoding()
+    # count tokens in the background while the answer is rendered
+    counter = ThreadPoolExecutor(max_workers=1)
     while True:
         console.print()
         try:
@@ -52,14 +82,20 @@ def main():
 
         if args.print_context:
             pprint(result["context"])
+            # chunks from '--splitter token' carry their token count
+            context_tokens = [doc.metadata.get("token_count") for doc in result["context"]]
+            if context_tokens and None not in context_tokens:
+                console.print(f"[bold green]Context Tokens:[/bold green] {sum(context_tokens)}")
 
         output_text = result["answer"]
-        output_token = len(encoding.encode(output_text))
+        output_token = counter.submit(lambda text: len(encoding.encode_ordinary(text)), output_text)
         console.print(Markdown(output_text))
         console.print(Markdown("---"))
-        console.print(f"[bold green]Output Tokens:[/bold green] {output_token}")
+        console.print(f"[bold green]Output Tokens:[/bold green] {output_token.result()}")
         console.print(Markdown("---"))
 
+    counter.shutdown()
+
 
 if __name__ == "__main__":
     main()
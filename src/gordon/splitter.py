@@ -0,0 +1,111 @@
+import os
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+import tiktoken
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+SPLITTERS = ("recursive", "rust", "token")
+
+# splitters are reused across calls with the same settings
+_splitter_cache: Dict[Tuple[str, int, int], Any] = {}
+
+
+@lru_cache(maxsize=None)
+def get_encoding() -> tiktoken.Encoding:
+    return tiktoken.encoding_for_model("gpt-4o")
+
+
+def get_splitter(splitter: str, chunk_size: int, chunk_overlap: int) -> Any:
+    """
+    Return the cached 'recursive' or 'rust' splitter for these settings, building it once.
+    """
+    key = (splitter, chunk_size, chunk_overlap)
+    if key not in _splitter_cache:
+        if splitter == "rust":
+            from semantic_text_splitter import TextSplitter
+
+            _splitter_cache[key] = TextSplitter(chunk_size, overlap=chunk_overlap)
+        else:
+            _splitter_cache[key] = RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size, chunk_overlap=chunk_overlap
+            )
+    return _splitter_cache[key]
+
+
+def _split_tokens(raw_docs: List[Document], chunk_size: int, chunk_overlap: int) -> List[Document]:
+    """
+    Encode every document once (in parallel, inside tiktoken) and cut the token
+    lists into overlapping windows, recording each chunk's token count.
+    Window edges are moved back to the nearest character boundary, so a
+    multi-byte character split across byte-level tokens is never cut in half.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError(
+            f"Got a larger chunk overlap ({chunk_overlap}) than chunk size "
+            f"({chunk_size}), should be smaller."
+        )
+    encoding = get_encoding()
+    num_threads = os.cpu_count() or 1
+    token_lists = encoding.encode_ordinary_batch([d.page_content for d in raw_docs], num_threads=num_threads)
+
+    windows: List[List[int]] = []
+    parents: List[Document] = []
+    for d, tokens in zip(raw_docs, token_lists):
+        n = len(tokens)
+
+        def at_boundary(i: int) -> bool:
+            # the text is valid UTF-8, so position i starts a character unless
+            # token i begins with a continuation byte (0b10xxxxxx)
+            return i <= 0 or i >= n or encoding.decode_single_token_bytes(tokens[i])[0] & 0xC0 != 0x80
+
+        def back_to_boundary(i: int, lo: int) -> int:
+            j = i
+            while j > lo and not at_boundary(j):
+                j -= 1
+            if at_boundary(j):
+                return j
+            # no boundary between lo and i (a single character wider than the window)
+            while not at_boundary(i):
+                i += 1
+            return i
+
+        start = 0
+        while start < n:
+            end = back_to_boundary(min(start + chunk_size, n), start + 1)
+            windows.append(tokens[start:end])
+            parents.append(d)
+            if end >= n:
+                break
+            start = back_to_boundary(max(end - chunk_overlap, start + 1), start + 1)
+
+    texts = encoding.decode_batch(windows, num_threads=num_threads)
+    return [
+        Document(page_content=text, metadata={**d.metadata, "token_count": len(window)})
+        for d, window, text in zip(parents, windows, texts)
+    ]
+
+
+def split_documents(raw_docs: List[Document], chunk_size: int, chunk_overlap: int,
+                    splitter: str = "recursive") -> List[Document]:
+    """
+    Split documents into chunks, keeping each parent's metadata.
+    'recursive' uses LangChain's pure-Python splitter, 'rust' uses
+    semantic-text-splitter and chunks all documents in one call.
+    Both measure chunk_size and chunk_overlap in characters; 'token'
+    measures them in tiktoken tokens and stores 'token_count' in the metadata.
+    """
+    if splitter == "token":
+        return _split_tokens(raw_docs, chunk_size, chunk_overlap)
+
+    text_splitter = get_splitter(splitter, chunk_size, chunk_overlap)
+    if splitter == "rust":
+        chunked = text_splitter.chunk_all([d.page_content for d in raw_docs])
+        return [
+            Document(page_content=chunk, metadata=dict(d.metadata))
+            for d, chunks in zip(raw_docs, chunked)
+            for chunk in chunks
+        ]
+
+    return text_splitter.split_documents(raw_docs)
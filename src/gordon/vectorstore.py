@@ -0,0 +1,364 @@
+import glob
+import os
+import pickle
+import queue
+import tempfile
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows; ingest runs unlocked there
+    fcntl = None
+
+import faiss
+import numpy as np
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_core.documents import Document
+from langchain_community.vectorstores import FAISS
+
+from .loadmodel import embeddings
+
+DEVICES = ("cpu", "gpu", "cuda")
+
+# quantizer/IVF training only needs a representative sample
+MAX_TRAIN_VECTORS = 100_000
+
+# docstore additions are appended as delta pickles and folded into
+# index.pkl once this many have accumulated
+MAX_DOCSTORE_DELTAS = 8
+
+# IVF lists visited per query unless query --nprobe says otherwise
+# (faiss defaults to 1, ie. 1/256 of an IVF256 index)
+DEFAULT_NPROBE = 16
+
+
+def index_to_gpu(vectordb: FAISS, fp16: bool = False) -> FAISS:
+    """
+    Move the raw FAISS index onto all visible GPUs, in place.
+    With fp16, vectors are stored as float16 on the GPU, halving memory and bandwidth.
+    Falls back to CPU when faiss was built without GPU support or no GPU is found.
+    """
+    num_gpus = faiss.get_num_gpus() if hasattr(faiss, "get_num_gpus") else 0
+    if num_gpus == 0 or not hasattr(faiss, "index_cpu_to_all_gpus"):
+        print("[!] No GPU available to FAISS (is faiss-gpu installed?), staying on CPU.")
+        return vectordb
+    print(f"[*] Moving FAISS index to {num_gpus} GPU(s)...")
+    co = faiss.GpuMultipleClonerOptions()
+    co.useFloat16 = fp16
+    try:
+        vectordb.index = faiss.index_cpu_to_all_gpus(vectordb.index, co=co)
+    except RuntimeError as e:
+        # not every index type has a GPU implementation (eg. HNSW)
+        print(f"[!] FAISS index cannot be moved to GPU, staying on CPU: {e}")
+    return vectordb
+
+
+def _fsync_dir(path: str) -> None:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _atomic_write(path: str, write: Callable[[str], None]) -> None:
+    """
+    Write path via a uniquely named temporary file and rename it into place,
+    so readers (and an interrupted ingest) only ever see the old or the new
+    file. The directory is synced too, so the rename itself survives a crash.
+    """
+    directory = os.path.dirname(path) or "."
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        # mkstemp creates the file 0600; give it the usual umask-based mode
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp, 0o666 & ~umask)
+        with open(tmp, "rb+") as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    _fsync_dir(directory)
+
+
+@contextmanager
+def _store_lock(index_path: str) -> Iterator[None]:
+    """
+    Hold an exclusive lock on index_path for a whole load-add-save cycle, so
+    concurrent ingests queue up instead of dropping each other's additions.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    with open(os.path.join(index_path, ".lock"), "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _pickle_to(obj: Any) -> Callable[[str], None]:
+    def write(path: str) -> None:
+        with open(path, "wb") as f:
+            pickle.dump(obj, f)
+    return write
+
+
+def _delta_paths(index_path: str) -> List[str]:
+    return sorted(glob.glob(os.path.join(index_path, "index.delta-*.pkl")))
+
+
+def _read_docstore(index_path: str) -> Tuple[InMemoryDocstore, Dict[int, str]]:
+    """
+    Read index.pkl, as FAISS.load_local does, then replay the delta pickles on top.
+    """
+    with open(os.path.join(index_path, "index.pkl"), "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    for path in _delta_paths(index_path):
+        with open(path, "rb") as f:
+            new_docs, new_ids = pickle.load(f)
+        # a consolidation interrupted before removing its deltas leaves
+        # entries that are already in index.pkl
+        docstore.add({
+            doc_id: doc for doc_id, doc in new_docs.items()
+            if not isinstance(docstore.search(doc_id), Document)
+        })
+        index_to_docstore_id.update(new_ids)
+    return docstore, index_to_docstore_id
+
+
+def set_search_params(index: faiss.Index, nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> None:
+    """
+    Set the IVF nprobe and HNSW efSearch of index, where it has them;
+    higher values trade speed for recall. An IVF index without an explicit
+    nprobe gets DEFAULT_NPROBE.
+    """
+    nlist = _ivf_nlist(index)
+    if nprobe is None and nlist:
+        nprobe = min(nlist, DEFAULT_NPROBE)
+    params = faiss.ParameterSpace()
+    for name, value in (("nprobe", nprobe), ("efSearch", ef_search)):
+        if value is None:
+            continue
+        try:
+            params.set_index_parameter(index, name, value)
+        except RuntimeError:
+            print(f"[!] FAISS index has no '{name}' parameter, ignoring it.")
+
+
+def load_store(index_path: str, device: str = "cpu", fp16: bool = False, mmap: bool = False,
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None) -> FAISS:
+    """
+    Load the store at index_path. With mmap, the index is memory-mapped read-only
+    so the OS pages vectors in on demand instead of copying the whole file into
+    RAM; this is for read-only use (query), the mapped index cannot be added to.
+    nprobe and ef_search are passed to set_search_params.
+    """
+    index_file = os.path.join(index_path, "index.faiss")
+    index = None
+    if mmap:
+        # one mapping mode only: faiss rejects IO_FLAG_MMAP combined with
+        # IO_FLAG_MMAP_IFC (zero-copy, faiss >= 1.10) on IVF indexes
+        flags = faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            index = faiss.read_index(index_file, flags)
+        except RuntimeError as e:
+            print(f"[!] FAISS index cannot be memory-mapped, reading it into RAM: {e}")
+    if index is None:
+        index = faiss.read_index(index_file)
+    set_search_params(index, nprobe=nprobe, ef_search=ef_search)
+    docstore, index_to_docstore_id = _read_docstore(index_path)
+    if len(index_to_docstore_id) > index.ntotal:
+        # a save interrupted between its delta and its index; drop the
+        # dangling positions so new vectors line up with their documents
+        index_to_docstore_id = {i: doc_id for i, doc_id in index_to_docstore_id.items() if i < index.ntotal}
+    vectordb = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=index_to_docstore_id,
+    )
+    if device in ("gpu", "cuda"):
+        index_to_gpu(vectordb, fp16=fp16)
+    return vectordb
+
+
+def save_store(vectordb: FAISS, index_path: str, start: int = 0) -> None:
+    """
+    Atomically save the store. Docstore entries for index positions >= start
+    are appended as a new delta pickle instead of rewriting index.pkl; pass
+    start=0 to write everything. The delta lands before the index that
+    references it, so an interrupted save never leaves vectors without documents.
+    """
+    os.makedirs(index_path, exist_ok=True)
+    base_path = os.path.join(index_path, "index.pkl")
+    deltas = _delta_paths(index_path)
+
+    if start == 0 or not os.path.exists(base_path) or len(deltas) >= MAX_DOCSTORE_DELTAS:
+        _atomic_write(base_path, _pickle_to((vectordb.docstore, vectordb.index_to_docstore_id)))
+        for path in deltas:
+            os.remove(path)
+    else:
+        new_ids = {i: doc_id for i, doc_id in vectordb.index_to_docstore_id.items() if i >= start}
+        new_docs = {doc_id: vectordb.docstore.search(doc_id) for doc_id in new_ids.values()}
+        seq = int(deltas[-1].rsplit("-", 1)[1].split(".")[0]) + 1 if deltas else 0
+        delta_path = os.path.join(index_path, f"index.delta-{seq:06d}.pkl")
+        _atomic_write(delta_path, _pickle_to((new_docs, new_ids)))
+
+    _atomic_write(
+        os.path.join(index_path, "index.faiss"),
+        lambda path: faiss.write_index(vectordb.index, path),
+    )
+
+
+def embed_batches(docs: List[Document], queue_size: int = 8) -> Iterator[Tuple[List[Document], np.ndarray]]:
+    """
+    Yield (batch, vectors) pairs while a background thread keeps embedding the
+    next batches, so FAISS insertion overlaps with the (network-bound) embedding.
+    If the consumer stops early (an error, or the generator is closed), the
+    thread stops embedding after its current batch.
+    """
+    # each call already fans out over the embedding server's concurrency
+    batch_size = embeddings.batch_size * embeddings.concurrency
+    out: queue.Queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    done = object()
+
+    def producer():
+        try:
+            for i in range(0, len(docs), batch_size):
+                if stop.is_set():
+                    return
+                batch = docs[i:i + batch_size]
+                vectors = embeddings.embed_documents([d.page_content for d in batch])
+                out.put((batch, np.asarray(vectors, dtype="float32")))
+        except Exception as e:
+            out.put(e)
+            return
+        out.put(done)
+
+    worker = threading.Thread(target=producer, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = out.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+        # unblock a put() waiting on a full queue, until the thread has exited
+        while worker.is_alive():
+            try:
+                out.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        worker.join()
+
+
+def _add_batch(vectordb: FAISS, batch: List[Document], vectors: np.ndarray) -> None:
+    vectordb.add_embeddings(
+        zip([d.page_content for d in batch], vectors),
+        metadatas=[d.metadata for d in batch],
+    )
+
+
+def _ivf_nlist(index: faiss.Index) -> int:
+    try:
+        return faiss.extract_index_ivf(index).nlist
+    except RuntimeError:
+        return 0  # not an IVF index
+
+
+def _min_train_vectors(index: faiss.Index) -> int:
+    """
+    Fewest vectors index.train accepts: k-means needs one per IVF list
+    and one per PQ centroid.
+    """
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexPreTransform):
+        return _min_train_vectors(index.index)
+    if isinstance(index, faiss.IndexHNSW):
+        return _min_train_vectors(index.storage)
+    pq = getattr(index, "pq", None)
+    return max(getattr(index, "nlist", 0), pq.ksub if pq is not None else 0)
+
+
+def create_store(docs: List[Document], index_spec: str = "Flat") -> FAISS:
+    """
+    Embed docs and build a new store whose index comes from faiss.index_factory,
+    eg. "Flat" (exact), "HNSW32" or "IVF256,Flat" (approximate), "SQ8" or
+    "HNSW32,SQ8" (int8 scalar-quantized, a quarter of the memory of float32).
+    """
+    if not docs:
+        raise ValueError("No documents to index")
+    # a single embedding gives the dimension, so the spec is checked
+    # before any batch is embedded
+    dim = len(embeddings.embed_query(docs[0].page_content))
+    index = faiss.index_factory(dim, index_spec, faiss.METRIC_L2)
+    n_train = min(len(docs), MAX_TRAIN_VECTORS)
+    need = 0 if index.is_trained else _min_train_vectors(index)
+    if need > n_train:
+        raise ValueError(
+            f"Index spec '{index_spec}' needs at least {need} vectors to train (IVF lists/PQ centroids) "
+            f"but only {n_train} chunks are available; use a smaller spec "
+            f"(eg. 'IVF{max(1, n_train // 39)},Flat') or 'Flat'/'HNSW32'."
+        )
+    vectordb = FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+
+    if index.is_trained:
+        for batch, vectors in embed_batches(docs):
+            _add_batch(vectordb, batch, vectors)
+        return vectordb
+
+    # training needs the vectors up front, so nothing to overlap here
+    pending = list(embed_batches(docs))
+    sample = np.vstack([vectors for _, vectors in pending])
+    if len(sample) > MAX_TRAIN_VECTORS:
+        rng = np.random.default_rng(0)
+        sample = sample[rng.choice(len(sample), MAX_TRAIN_VECTORS, replace=False)]
+    print(f"[*] Training '{index_spec}' index on {len(sample)} vectors...")
+    index.train(sample)
+    for batch, vectors in pending:
+        _add_batch(vectordb, batch, vectors)
+    return vectordb
+
+
+def add_to_store(docs: List[Document], index_path: str, index_spec: str = "Flat") -> FAISS:
+    """
+    Add docs to the store at index_path, creating it if needed, and save it.
+    index_spec only applies to a new store; an existing one keeps its index type.
+    Ingest stays on CPU: adding vectors gains nothing from a GPU, and the
+    index would have to be copied back to be saved. See query --device.
+    The store is locked from load to save, so parallel ingests are serialized.
+    """
+    with _store_lock(index_path):
+        if os.path.exists(os.path.join(index_path, "index.faiss")):
+            print(f"[*] Loading existing FAISS index from '{index_path}' and adding documents...")
+            vectordb = load_store(index_path)
+            start = vectordb.index.ntotal
+            for batch, vectors in embed_batches(docs):
+                _add_batch(vectordb, batch, vectors)
+        else:
+            print(f"[*] Creating new '{index_spec}' FAISS index from documents...")
+            vectordb = create_store(docs, index_spec=index_spec)
+            start = 0
+
+        print(f"[*] Saving vector store to '{index_path}' ...")
+        save_store(vectordb, index_path, start=start)
+    return vectordb